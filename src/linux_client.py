@@ -3,17 +3,31 @@ Linux SSH клиент — поддержка bash/zsh/fish.
 Запускаем явный bash с контролируемым промптом.
 """
 
-import asyncio
 import re
+import uuid
+from base64 import b64encode
 
-from .ssh_client import SSHSession
+from .ssh_client import ANSI_RE, SSHSession, compile_prompt
 
 MCP_PROMPT = "MCPSSH>"
 MCP_PROMPT_RE = r"MCPSSH>"
 
+# Размер куска base64 (символов) на одну команду при загрузке файла
+UPLOAD_CHUNK = 3072
+
 # Широкий паттерн для первого промпта (любой shell включая zsh fancy)
 INITIAL_PROMPT_RE = r"[\$#>%]\s*$|└──>\s*$|»\s*$|❯\s*$"
 
+# Маркер готовности shell в _post_connect
+READY_MARKER = "__MCP_READY_$$__"
+READY_RE = r"__MCP_READY_\d+__"
+
+_MCP_PROMPT = compile_prompt(MCP_PROMPT_RE)
+_INITIAL_PROMPT = compile_prompt(INITIAL_PROMPT_RE)
+_READY_PROMPT = compile_prompt(rf"{READY_RE}\s*{MCP_PROMPT_RE}")
+# Промпт и эхо введённой за ним строки — в выводе exec_multi не нужны
+_PROMPT_ECHO_RE = re.compile(rf"{MCP_PROMPT_RE}[^\n]*")
+
 
 class LinuxSession(SSHSession):
     """SSH-сессия для Linux-хостов."""
@@ -22,6 +36,7 @@ class LinuxSession(SSHSession):
         super().__init__()
         self.device_type = "linux"
         self._prompt_re = INITIAL_PROMPT_RE
+        self._prompt_regex = _INITIAL_PROMPT
 
     @property
     def _prompt_pattern(self) -> str:
@@ -29,54 +44,142 @@ class LinuxSession(SSHSession):
 
     async def _post_connect(self) -> None:
         """Дождаться любого промпта, запустить bash с нашим промптом."""
-        await self._read_until(INITIAL_PROMPT_RE, timeout=20)
+        await self._read_until(_INITIAL_PROMPT, timeout=20)
 
-        # Запускаем bash явно (работает из любого shell включая zsh/fish)
-        await self._send("env -i HOME=$HOME USER=$USER TERM=dumb bash --norc --noprofile\n")
-        await asyncio.sleep(0.8)
-
-        # Устанавливаем уникальный промпт + чистим окружение
+        # Запускаем bash явно (работает из любого shell включая zsh/fish).
+        # PS1/TERM/HISTFILE задаются прямо в окружении bash — одна строка
+        # подготовки вместо отдельной команды. Вместо фиксированной паузы ждём
+        # маркер готовности: в эхе ввода стоит '$$', а в выводе — PID; сразу
+        # за маркером должен идти MCPSSH>, то есть новый PS1 уже активен
         await self._send(
-            f"PS1='{MCP_PROMPT} '; export PS1; export TERM=dumb; unset HISTFILE\n"
+            f"env -i HOME=$HOME USER=$USER TERM=dumb PS1='{MCP_PROMPT} ' HISTFILE= "
+            f"bash --norc --noprofile\n"
+            f"echo {READY_MARKER}\n"
         )
-        await asyncio.sleep(0.5)
+        await self._read_until(_READY_PROMPT, timeout=20)
 
         # Переключаемся на наш промпт
         self._prompt_re = MCP_PROMPT_RE
-        await self._read_until(self._prompt_re, timeout=10)
+        self._prompt_regex = _MCP_PROMPT
+
+    def _marker_line(self, marker: str) -> str:
+        # Эхо ввода в bash может обогнать вывод предыдущей команды, поэтому
+        # маркер — вывод echo; пустые '' рвут маркер в эхе самой строки
+        return f"echo {marker[:2]}''{marker[2:]}"
 
     async def exec(self, command: str, timeout: float = 60.0) -> str:
         """Выполнить shell-команду и вернуть вывод."""
         return await self.send_command(command, timeout=timeout)
 
     async def exec_multi(self, commands: list[str], timeout: float = 60.0) -> list[dict]:
-        """Выполнить список команд последовательно."""
+        """
+        Выполнить список команд за один round-trip.
+
+        Каждая команда уходит своей строкой, за ней — echo уникального
+        маркера с номером и кодом возврата; по маркерам вывод режется обратно.
+        Отдельные строки не дают одной команде (фоновый '&', комментарий,
+        пустая строка) сломать весь пакет. timeout — на каждую команду.
+        """
+        if not commands:
+            return []
+        sentinel = f"__MCP_D_{uuid.uuid4().hex}"
+        block = "".join(
+            f"{cmd.strip()}\necho {sentinel}_{i}_$?\n" for i, cmd in enumerate(commands)
+        )
+        # Конец пакета — напечатанный маркер последней команды и промпт за ним;
+        # в эхе ввода вместо кода стоит '$?', так что эхо не совпадёт
+        last = re.escape(f"{sentinel}_{len(commands) - 1}_").encode()
+        done_re = compile_prompt(last + rb"\d+.*" + _MCP_PROMPT.pattern)
+        error = None
+        try:
+            self._reset_buffer()
+            await self._send(block)
+            raw = await self._read_until(done_re, timeout=timeout * len(commands))
+        except Exception as e:
+            # Таймаут или переполнение: команды с напечатанным маркером уже
+            # выполнились — их результаты разбираем из того, что пришло
+            error = str(e)
+            raw = self._take()
+
+        # Промпт перед первой командой уже забран из буфера — возвращаем его,
+        # чтобы эхо первой строки снималось так же, как у остальных
+        cleaned = _PROMPT_ECHO_RE.sub("", f"{MCP_PROMPT} " + ANSI_RE.sub("", raw))
+        # [out0, idx0, code0, out1, idx1, code1, ..., хвост]; маркер засчитан,
+        # только если строка с ним дошла целиком
+        parts = re.split(rf"{sentinel}_(\d+)_(\d+)(?=\n)", cleaned)
+        done = {
+            int(parts[j + 1]): (parts[j], int(parts[j + 2]))
+            for j in range(0, len(parts) - 2, 3)
+        }
+
+        def output_of(segment: str) -> str:
+            return "\n".join(
+                line.rstrip() for line in segment.split("\n")
+                if line.strip() and sentinel not in line
+            )
+
         results = []
-        for cmd in commands:
-            try:
-                output = await self.exec(cmd, timeout=timeout)
-                results.append({"command": cmd, "output": output, "error": None})
-            except Exception as e:
-                results.append({"command": cmd, "output": "", "error": str(e)})
+        stopped_at = None
+        for i, cmd in enumerate(commands):
+            if i in done and stopped_at is None:
+                segment, code = done[i]
+                results.append({
+                    "command": cmd,
+                    "output": output_of(segment),
+                    "error": f"exit code {code}" if code else None,
+                })
+            elif stopped_at is None:
+                # Первая незавершённая: её частичный вывод — хвост после
+                # последнего маркера, полная ошибка (с дампом буфера) — только здесь
+                stopped_at = cmd
+                results.append({
+                    "command": cmd,
+                    "output": output_of(parts[-1]),
+                    "error": error or "no completion marker",
+                })
+            else:
+                results.append({
+                    "command": cmd,
+                    "output": "",
+                    "error": f"not completed: batch stopped at '{stopped_at}'",
+                })
         return results
 
     async def upload_text(self, remote_path: str, content: str) -> str:
-        """Записать текст в файл через base64."""
-        import base64
-        encoded = base64.b64encode(content.encode()).decode()
-        cmd = f"echo '{encoded}' | base64 -d > {remote_path}"
-        return await self.exec(cmd)
+        """
+        Записать текст в файл через base64.
+
+        Содержимое дописывается кусками во временный .b64-файл и декодируется
+        в конце — без одной гигантской строки аргументов. Все шаги уходят
+        одним exec_multi, то есть за один round-trip.
+        """
+        encoded = b64encode(content.encode()).decode("ascii")
+        tmp_path = f"{remote_path}.b64"
+        commands = [f": > {tmp_path}"]
+        commands += [
+            f"echo '{encoded[i:i + UPLOAD_CHUNK]}' >> {tmp_path}"
+            for i in range(0, len(encoded), UPLOAD_CHUNK)
+        ]
+        commands.append(f"base64 -d {tmp_path} > {remote_path} && rm -f {tmp_path}")
+
+        results = await self.exec_multi(commands)
+        failed = next((r for r in results if r["error"]), None)
+        if failed:
+            raise RuntimeError(f"upload to {remote_path} failed: {failed['error']}\n{failed['output']}")
+        return "\n".join(r["output"] for r in results if r["output"])
 
     async def get_os_info(self) -> dict:
-        """Получить базовую информацию об ОС."""
-        hostname = await self.exec("hostname", timeout=10)
-        uname = await self.exec("uname -a", timeout=10)
-        try:
-            os_release = await self.exec("cat /etc/os-release 2>/dev/null | head -5", timeout=10)
-        except Exception:
-            os_release = "N/A"
+        """Получить базовую информацию об ОС (один round-trip через exec_multi)."""
+        hostname, uname, os_release = await self.exec_multi([
+            "hostname",
+            "uname -a",
+            "cat /etc/os-release 2>/dev/null | head -5",
+        ], timeout=15)
+        for step in (hostname, uname):
+            if step["error"] and not step["output"]:
+                raise RuntimeError(f"{step['command']}: {step['error']}")
         return {
-            "hostname": hostname.strip(),
-            "uname": uname.strip(),
-            "os_release": os_release.strip(),
+            "hostname": hostname["output"].strip(),
+            "uname": uname["output"].strip(),
+            "os_release": os_release["output"].strip() or "N/A",
         }
@@ -29,7 +29,7 @@ import asyncio
 import json
 import logging
 import sys
-from typing import Any, Optional
+from typing import Any, Awaitable, Callable, Optional
 
 from mcp.server import Server
 from mcp.server.stdio import stdio_server
@@ -79,6 +79,11 @@ TOOLS = [
                     "description": "Optional human-readable session name (e.g. 'pe1'). Used as session_id.",
                 },
                 "timeout": {"type": "integer", "default": 30, "description": "Connection timeout in seconds"},
+                "compression": {
+                    "type": "boolean",
+                    "default": False,
+                    "description": "Negotiate zlib compression; worth it for large show/display-config outputs",
+                },
             },
             "required": ["host", "username"],
         },
@@ -201,11 +206,19 @@ TOOLS = [
     ),
     Tool(
         name="sros_get_context",
-        description="Get the current MD-CLI context path (equivalent to 'pwc' command).",
+        description=(
+            "Get the current MD-CLI context path. Taken from the last prompt; "
+            "set refresh=true to query the device with 'pwc'."
+        ),
         inputSchema={
             "type": "object",
             "properties": {
                 "session_id": {"type": "string"},
+                "refresh": {
+                    "type": "boolean",
+                    "default": False,
+                    "description": "Run 'pwc' on the device instead of using the tracked context",
+                },
             },
             "required": ["session_id"],
         },
@@ -246,91 +259,127 @@ async def call_tool(name: str, arguments: dict) -> list[TextContent]:
         return [TextContent(type="text", text=f"Error: {type(e).__name__}: {e}")]
 
 
+# Один энкодер на процесс; компактный вывод без отступов — ответы читает
+# модель, а не человек, и отступы только добавляют байты/токены
+_json_encode = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+
 def _to_text(obj: Any) -> str:
     if isinstance(obj, str):
         return obj
-    return json.dumps(obj, ensure_ascii=False, indent=2)
+    return _json_encode(obj)
+
+
+# ── Session management ────────────────────────────────────────────────────
+
+async def _h_ssh_connect(args: dict) -> Any:
+    session_id = await sessions.create_session(
+        host=args["host"],
+        username=args["username"],
+        password=args.get("password"),
+        private_key=args.get("private_key"),
+        port=args.get("port", 22),
+        device_type=args.get("device_type", "linux"),
+        label=args.get("label"),
+        timeout=args.get("timeout", 30),
+        compression=args.get("compression", False),
+    )
+    session_list = sessions.list_sessions()
+    info = next((s for s in session_list if s["session_id"] == session_id), {})
+    return {
+        "session_id": session_id,
+        "host": info.get("host"),
+        "device_type": info.get("device_type"),
+        "status": "connected",
+    }
+
+
+async def _h_ssh_disconnect(args: dict) -> Any:
+    await sessions.close_session(args["session_id"])
+    return {"status": "disconnected", "session_id": args["session_id"]}
+
+
+async def _h_ssh_list_sessions(args: dict) -> Any:
+    return sessions.list_sessions()
+
+
+# ── Linux ─────────────────────────────────────────────────────────────────
+
+async def _h_ssh_exec(args: dict) -> Any:
+    session = await sessions.get_session(args["session_id"])
+    output = await session.exec(args["command"], timeout=args.get("timeout", 60))
+    return {"command": args["command"], "output": output}
+
+
+async def _h_ssh_exec_multi(args: dict) -> Any:
+    session = await sessions.get_session(args["session_id"])
+    results = await session.exec_multi(args["commands"], timeout=args.get("timeout", 60))
+    return results
+
+
+async def _h_ssh_send_raw(args: dict) -> Any:
+    session = await sessions.get_session(args["session_id"])
+    text = args["text"].encode().decode("unicode_escape")  # handle \n \x03 etc.
+    wait = args.get("wait_seconds", 1.0)
+    received = await session.send_raw(text, wait_seconds=wait)
+    return {"sent": repr(text), "received": received}
+
+
+async def _h_linux_os_info(args: dict) -> Any:
+    session = await sessions.get_session(args["session_id"])
+    return await session.get_os_info()
+
+
+# ── SR OS ─────────────────────────────────────────────────────────────────
+
+async def _h_sros_cli(args: dict) -> Any:
+    session = await sessions.get_session(args["session_id"])
+    output = await session.cli(args["command"], timeout=args.get("timeout", 60))
+    return {"command": args["command"], "output": output}
+
+
+async def _h_sros_configure(args: dict) -> Any:
+    session = await sessions.get_session(args["session_id"])
+    result = await session.configure(
+        commands=args["commands"],
+        commit=args.get("commit", True),
+    )
+    return result
+
+
+async def _h_sros_get_context(args: dict) -> Any:
+    session = await sessions.get_session(args["session_id"])
+    context = await session.get_context(refresh=args.get("refresh", False))
+    return {"context": context}
+
+
+async def _h_sros_rollback(args: dict) -> Any:
+    session = await sessions.get_session(args["session_id"])
+    output = await session.rollback(args.get("index", 1))
+    return {"output": output}
+
+
+# Имя инструмента -> обработчик: один поиск в dict вместо цепочки if
+_HANDLERS: dict[str, Callable[[dict], Awaitable[Any]]] = {
+    "ssh_connect": _h_ssh_connect,
+    "ssh_disconnect": _h_ssh_disconnect,
+    "ssh_list_sessions": _h_ssh_list_sessions,
+    "ssh_exec": _h_ssh_exec,
+    "ssh_exec_multi": _h_ssh_exec_multi,
+    "ssh_send_raw": _h_ssh_send_raw,
+    "linux_os_info": _h_linux_os_info,
+    "sros_cli": _h_sros_cli,
+    "sros_configure": _h_sros_configure,
+    "sros_get_context": _h_sros_get_context,
+    "sros_rollback": _h_sros_rollback,
+}
 
 
 async def _dispatch(name: str, args: dict) -> Any:
-    # ── Session management ────────────────────────────────────────────────
-
-    if name == "ssh_connect":
-        session_id = await sessions.create_session(
-            host=args["host"],
-            username=args["username"],
-            password=args.get("password"),
-            private_key=args.get("private_key"),
-            port=args.get("port", 22),
-            device_type=args.get("device_type", "linux"),
-            label=args.get("label"),
-            timeout=args.get("timeout", 30),
-        )
-        session_list = sessions.list_sessions()
-        info = next((s for s in session_list if s["session_id"] == session_id), {})
-        return {
-            "session_id": session_id,
-            "host": info.get("host"),
-            "device_type": info.get("device_type"),
-            "status": "connected",
-        }
-
-    if name == "ssh_disconnect":
-        await sessions.close_session(args["session_id"])
-        return {"status": "disconnected", "session_id": args["session_id"]}
-
-    if name == "ssh_list_sessions":
-        return sessions.list_sessions()
-
-    # ── Linux ─────────────────────────────────────────────────────────────
-
-    if name == "ssh_exec":
-        session = await sessions.get_session(args["session_id"])
-        output = await session.exec(args["command"], timeout=args.get("timeout", 60))
-        return {"command": args["command"], "output": output}
-
-    if name == "ssh_exec_multi":
-        session = await sessions.get_session(args["session_id"])
-        results = await session.exec_multi(args["commands"], timeout=args.get("timeout", 60))
-        return results
-
-    if name == "ssh_send_raw":
-        session = await sessions.get_session(args["session_id"])
-        text = args["text"].encode().decode("unicode_escape")  # handle \n \x03 etc.
-        wait = args.get("wait_seconds", 1.0)
-        received = await session.send_raw(text, wait_seconds=wait)
-        return {"sent": repr(text), "received": received}
-
-    if name == "linux_os_info":
-        session = await sessions.get_session(args["session_id"])
-        return await session.get_os_info()
-
-    # ── SR OS ─────────────────────────────────────────────────────────────
-
-    if name == "sros_cli":
-        session = await sessions.get_session(args["session_id"])
-        output = await session.cli(args["command"], timeout=args.get("timeout", 60))
-        return {"command": args["command"], "output": output}
-
-    if name == "sros_configure":
-        session = await sessions.get_session(args["session_id"])
-        result = await session.configure(
-            commands=args["commands"],
-            commit=args.get("commit", True),
-        )
-        return result
-
-    if name == "sros_get_context":
-        session = await sessions.get_session(args["session_id"])
-        context = await session.get_context()
-        return {"context": context}
-
-    if name == "sros_rollback":
-        session = await sessions.get_session(args["session_id"])
-        output = await session.rollback(args.get("index", 1))
-        return {"output": output}
-
-    raise ValueError(f"Unknown tool: {name}")
+    handler = _HANDLERS.get(name)
+    if handler is None:
+        raise ValueError(f"Unknown tool: {name}")
+    return await handler(args)
 
 
 # ─────────────────────────────────────────────────────────────────────────────
@@ -3,11 +3,12 @@ Session Manager — хранит активные SSH-сессии в памят
 """
 
 import asyncio
+import heapq
+import secrets
 import time
-import uuid
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Tuple
 
-from .ssh_client import SSHSession
+from .ssh_client import POOL, SSHSession
 from .sros_client import SROSSession
 from .linux_client import LinuxSession
 
@@ -17,11 +18,20 @@ class SessionManager:
         self._sessions: Dict[str, SSHSession] = {}
         self._labels: Dict[str, str] = {}  # label -> session_id
         self._created_at: Dict[str, float] = {}
+        # Неизменяемые за время жизни сессии поля для list_sessions
+        self._meta: Dict[str, dict] = {}
+        # Очередь истечения TTL: (expires_at, session_id), минимум сверху
+        self._expiry: List[Tuple[float, str]] = []
         self._default_ttl = default_ttl
         self._lock = asyncio.Lock()
+        # id сессий, которые ещё подключаются (connect идёт без лока)
+        self._pending: set = set()
 
     def _new_id(self) -> str:
-        return str(uuid.uuid4())[:8]
+        while True:
+            session_id = secrets.token_hex(4)
+            if session_id not in self._sessions and session_id not in self._pending:
+                return session_id
 
     async def create_session(
         self,
@@ -33,20 +43,25 @@ class SessionManager:
         device_type: str = "linux",
         label: Optional[str] = None,
         timeout: int = 30,
+        compression: bool = False,
     ) -> str:
-        """Открыть новую SSH-сессию. Вернуть session_id."""
-        async with self._lock:
-            session_id = label or self._new_id()
-
-            # Закрыть существующую сессию с тем же label/id
-            if session_id in self._sessions:
-                await self._sessions[session_id].close()
-
-            if device_type == "sros":
-                session = SROSSession()
-            else:
-                session = LinuxSession()
-
+        """
+        Открыть новую SSH-сессию. Вернуть session_id.
+
+        Подключение (handshake, _post_connect) идёт без лока: иначе все
+        ssh_connect шли бы строго по одному даже к разным хостам, а
+        ограничение handshake в ssh_client не включалось бы вовсе.
+        """
+        # Резерв id синхронный — без await между проверкой и add
+        session_id = label or self._new_id()
+        self._pending.add(session_id)
+
+        if device_type == "sros":
+            session = SROSSession()
+        else:
+            session = LinuxSession()
+
+        try:
             await session.connect(
                 host=host,
                 port=port,
@@ -54,10 +69,30 @@ class SessionManager:
                 password=password,
                 private_key=private_key,
                 timeout=timeout,
+                compression=compression,
             )
+        except BaseException:
+            self._pending.discard(session_id)
+            # Вернуть транспорт в пул, если канал успел открыться
+            await self._safe_close(session)
+            raise
+
+        async with self._lock:
+            self._pending.discard(session_id)
+            # Заменить существующую сессию с тем же label/id
+            if session_id in self._sessions:
+                await self._close_locked(session_id)
 
             self._sessions[session_id] = session
-            self._created_at[session_id] = time.time()
+            created = time.time()
+            self._created_at[session_id] = created
+            heapq.heappush(self._expiry, (created + self._default_ttl, session_id))
+            self._meta[session_id] = {
+                "session_id": session_id,
+                "host": session.host,
+                "username": session.username,
+                "device_type": session.device_type,
+            }
             if label:
                 self._labels[label] = session_id
 
@@ -71,40 +106,59 @@ class SessionManager:
 
     async def close_session(self, session_id: str) -> None:
         async with self._lock:
-            session = self._sessions.pop(session_id, None)
-            if session:
-                await session.close()
-            self._created_at.pop(session_id, None)
+            await self._close_locked(session_id)
+
+    async def _close_locked(self, session_id: str) -> None:
+        session = self._sessions.pop(session_id, None)
+        if session:
+            await session.close()
+        self._created_at.pop(session_id, None)
+        self._meta.pop(session_id, None)
 
     def list_sessions(self) -> list:
-        result = []
-        for sid, session in self._sessions.items():
-            result.append({
-                "session_id": sid,
-                "host": session.host,
-                "username": session.username,
-                "device_type": session.device_type,
+        # Снимок без await: create/close не могут вклиниться между копией
+        # и построением ответа, а лок не нужен синхронному методу
+        items = tuple(self._sessions.items())
+        meta = self._meta.copy()
+        created_at = self._created_at.copy()
+        now = time.time()
+        return [
+            {
+                **meta[sid],
                 "connected": session.is_connected,
-                "age_seconds": int(time.time() - self._created_at.get(sid, 0)),
-            })
-        return result
+                "age_seconds": int(now - created_at.get(sid, now)),
+            }
+            for sid, session in items
+            if sid in meta
+        ]
 
     async def cleanup_expired(self) -> None:
         """Закрыть сессии старше TTL."""
         now = time.time()
-        expired = [
-            sid for sid, t in self._created_at.items()
-            if now - t > self._default_ttl
-        ]
-        for sid in expired:
-            await self.close_session(sid)
+        expiry = self._expiry
+        while expiry and expiry[0][0] <= now:
+            _, sid = heapq.heappop(expiry)
+            # Запись могла устареть: сессию закрыли или пересоздали с тем же label
+            created = self._created_at.get(sid)
+            if created is not None and created + self._default_ttl <= now:
+                await self.close_session(sid)
 
     async def close_all(self) -> None:
         async with self._lock:
-            for session in self._sessions.values():
-                try:
-                    await session.close()
-                except Exception:
-                    pass
+            to_close = list(self._sessions.values())
             self._sessions.clear()
             self._created_at.clear()
+            self._meta.clear()
+            self._expiry.clear()
+        # Закрываем параллельно и уже без лока — сетевой I/O не блокирует
+        # новые запросы, время остановки ~ одного RTT, а не N
+        await asyncio.gather(*(self._safe_close(s) for s in to_close),
+                             return_exceptions=True)
+        await POOL.close_all()
+
+    @staticmethod
+    async def _safe_close(session: SSHSession) -> None:
+        try:
+            await session.close()
+        except Exception:
+            pass
@@ -13,20 +13,38 @@ Nokia SR OS MD-CLI клиент (model-driven режим, SR OS 23+).
 import re
 from typing import Optional
 
-from .ssh_client import SSHSession
+from .ssh_client import SSHSession, compile_prompt
 
 
 # Промпт MD-CLI — последняя строка всегда: A:<user>@<host>#
-SROS_PROMPT_RE = r"[\*\!]?\(?[\w\-]*\)?(\[.*?\])?\r?\n[AB]:[^\s#@]+@[^\s#]+#\s*$"
+# Якоря ^ (с MULTILINE) и \Z, ограниченная длина и без .* — проверяется
+# только последняя строка буфера, без бэктрекинга по длинному выводу show
+SROS_PROMPT_RE = r"^[AB]:[^\s#>]{1,128}[#>][ \t]*\Z"
+# Промпт всегда в хвосте буфера — дальше последних N байт не ищем
+SROS_PROMPT_TAIL = 256
+
+_HOSTNAME_RE = re.compile(r"[AB]:[^\s#@]+@([^\s#]+)#")
+_PWC_RE = re.compile(r"Current context:\s*(.+)")
+# Строка контекста над промптом: [/], (ex)[/configure], *(ex)[/configure router "Base"]
+_CONTEXT_LINE_RE = re.compile(r"^[!*]*(?:\([a-z]+\))?\[(.*)\][ \t]*\n[AB]:", re.MULTILINE)
+# Строка контекста стоит прямо перед промптом — ищем в этом хвосте вывода
+CONTEXT_TAIL = 4096
 
 
 class SROSSession(SSHSession):
     """SSH-сессия для Nokia SR OS в MD-CLI model-driven режиме."""
 
+    _prompt_regex = compile_prompt(SROS_PROMPT_RE, re.MULTILINE)
+    _prompt_tail = SROS_PROMPT_TAIL
+    # Промпт кончается на # или > — без них в хвосте regex не запускаем
+    _prompt_hint = b"#>"
+
     def __init__(self):
         super().__init__()
         self.device_type = "sros"
         self._hostname: str = ""
+        # Контекст из последнего промпта; None — ещё не известен
+        self._current_context: Optional[str] = None
 
     @property
     def _prompt_pattern(self) -> str:
@@ -34,14 +52,44 @@ class SROSSession(SSHSession):
 
     async def _post_connect(self) -> None:
         """Дождаться приветствия и отключить пейджинг."""
-        banner = await self._read_until(SROS_PROMPT_RE, timeout=30)
+        banner = await self._read_until(
+            self._prompt_regex, timeout=30, tail=self._prompt_tail)
         # Извлечь hostname
-        m = re.search(r"[AB]:[^\s#@]+@([^\s#]+)#", banner)
+        m = _HOSTNAME_RE.search(banner)
         if m:
             self._hostname = m.group(1)
+        self._track_context(banner)
         # Отключить пейджинг
         await self.send_command("environment more false", timeout=10)
 
+    def _track_context(self, raw: str) -> None:
+        """Запомнить контекст из строки над последним промптом в выводе."""
+        last = None
+        for last in _CONTEXT_LINE_RE.finditer(raw[-CONTEXT_TAIL:]):
+            pass
+        if last is not None:
+            self._current_context = last.group(1).strip()
+
+    def _clean_output(self, raw, command):
+        # Каждый ответ проходит здесь — MD-CLI сам печатает контекст над
+        # промптом, так что он известен без отдельного pwc
+        self._track_context(raw)
+        return super()._clean_output(raw, command)
+
+    async def send_raw(self, text, wait_seconds=1.0):
+        output = await super().send_raw(text, wait_seconds)
+        # Сырой ввод мог сменить контекст: если промпт за wait_seconds не
+        # пришёл, контекст неизвестен и get_context спросит pwc
+        self._current_context = None
+        self._track_context(output)
+        return output
+
+    async def stream_command(self, command, timeout=60.0):
+        # Промпт в поток не попадает — после команды контекст неизвестен
+        self._current_context = None
+        async for chunk in super().stream_command(command, timeout=timeout):
+            yield chunk
+
     async def cli(self, command: str, timeout: float = 60.0) -> str:
         """
         Выполнить MD-CLI операционную команду.
@@ -60,37 +108,37 @@ class SROSSession(SSHSession):
             ["/configure router Base interface system ipv4 primary address 1.1.1.1 prefix-length 32"]
         commit: True = commit, False = discard
         """
-        results = []
-
-        # Войти в edit-config exclusive
-        enter_out = await self.send_command("edit-config exclusive", timeout=15)
-        results.append({"command": "edit-config exclusive", "output": enter_out})
-
-        for cmd in commands:
-            out = await self.send_command(cmd, timeout=30)
-            results.append({"command": cmd, "output": out})
-
-        # Commit или discard
-        if commit:
-            commit_out = await self.send_command("commit", timeout=30)
-            results.append({"command": "commit", "output": commit_out})
-        else:
-            discard_out = await self.send_command("discard", timeout=15)
-            results.append({"command": "discard", "output": discard_out})
-
-        # Выйти из configure режима
-        quit_out = await self.send_command("quit-config", timeout=10)
-        results.append({"command": "quit-config", "output": quit_out})
-
+        finish = "commit" if commit else "discard"
+        steps = ["edit-config exclusive", *commands, finish, "quit-config"]
+        # Таймауты шагов те же, что при пошаговом выполнении — в сумме
+        timeout = 15 + 30 * len(commands) + (30 if commit else 15) + 10
+
+        # Весь блок — одна запись и одно ожидание промпта (см. send_batch)
+        outputs = await self.send_batch(steps, timeout=timeout)
+        results = [
+            {"command": step, "output": output}
+            for step, output in zip(steps, outputs)
+        ]
         return {
             "committed": commit,
             "steps": results,
         }
 
-    async def get_context(self) -> str:
-        """Получить текущий CLI-контекст (pwc)."""
+    async def get_context(self, refresh: bool = False) -> str:
+        """
+        Получить текущий CLI-контекст. Берётся из последнего промпта без
+        обмена с устройством; pwc — при refresh=True или если контекст
+        ещё не известен.
+        """
+        if not refresh and self._current_context is not None:
+            return self._current_context
+        # Ответ на pwc проходит _clean_output, и свежий промпт обновляет
+        # контекст — тот же формат, что и у кэша; разбор текста pwc — запасной
+        self._current_context = None
         output = await self.send_command("pwc", timeout=10)
-        m = re.search(r"Current context:\s*(.+)", output)
+        if self._current_context is not None:
+            return self._current_context
+        m = _PWC_RE.search(output)
         return m.group(1).strip() if m else output.strip()
 
     async def rollback(self, index: int = 1) -> str:
@@ -1,114 +1,732 @@
 import asyncio
+import functools
+import hashlib
+import os
 import re
+import time
+import uuid
 from abc import ABC, abstractmethod
-from typing import Optional
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
 import asyncssh
 
+try:
+    # google-re2: DFA с линейным временем, без бэктрекинга (опционально)
+    import re2
+except ImportError:
+    re2 = None
+
 ANSI_RE = re.compile(r"\x1b\[[0-9;?]*[a-zA-Z]|\x1b[=>]|\r")
+# Тот же паттерн для сырого байтового буфера
+ANSI_BYTES_RE = re.compile(ANSI_RE.pattern.encode())
+# Начало ESC-последовательности, оборванное на границе куска
+_ANSI_PARTIAL_RE = re.compile(rb"\x1b(?:\[[0-9;?]*)?\Z")
+PROMPT_FLAGS = re.MULTILINE | re.DOTALL
+# Чистка вывода в _clean_output: хвостовые пробелы и пустые строки
+_TRAILING_WS_RE = re.compile(r"[ \t]+$", re.MULTILINE)
+_BLANK_LINES_RE = re.compile(r"\n\s*\n")
+# Промпты и маркеры короче этого окна: при повторном поиске достаточно
+# захватить столько байт уже просмотренного буфера перед новыми данными
+PROMPT_WINDOW = 512
+# Потолок буфера без найденного промпта: дальше приём из канала ставится
+# на паузу, пока буфер не разберут (backpressure через SSH-окно), а
+# _read_until сдаётся
+MAX_BUFFER = int(os.getenv("SSH_MAX_BUFFER", str(16 * 1024 * 1024)))
+
+# Пул транспортов: соединение без каналов закрывается после POOL_IDLE_TIMEOUT,
+# старше POOL_MAX_AGE — больше не выдаётся новым сессиям
+POOL_IDLE_TIMEOUT = 300
+POOL_MAX_AGE = 3600
+POOL_REAP_INTERVAL = 30
+
+# Ограничение новых handshake: sshd по умолчанию (MaxStartups=10) начинает
+# сбрасывать соединения при всплеске — ограничиваем и число, и частоту
+MAX_CONCURRENT_HANDSHAKES = int(os.getenv("SSH_MAX_HANDSHAKES", "8"))
+HANDSHAKE_RATE = float(os.getenv("SSH_HANDSHAKE_RATE", "5"))
+HANDSHAKE_BURST = int(os.getenv("SSH_HANDSHAKE_BURST", "10"))
+# Размыкатель: после BREAKER_THRESHOLD отказов подряд (auth, обрыв на
+# handshake) новые попытки к (host, username) отклоняются BREAKER_COOLDOWN с
+BREAKER_THRESHOLD = int(os.getenv("SSH_BREAKER_THRESHOLD", "3"))
+BREAKER_COOLDOWN = float(os.getenv("SSH_BREAKER_COOLDOWN", "30"))
+
+# Сжатие транспорта (opt-in): окупается на многомегабайтных show и
+# display-config, на мелких командах только тратит CPU
+COMPRESSION_ALGS = ["zlib@openssh.com", "zlib", "none"]
+
+# (host, port, username, отпечаток кредов, сжатие)
+PoolKey = Tuple[str, int, str, str, bool]
+
+
+def compile_prompt(pattern, flags=PROMPT_FLAGS) -> re.Pattern:
+    """Скомпилировать паттерн промпта под байтовый буфер сессии."""
+    if isinstance(pattern, re.Pattern):
+        if isinstance(pattern.pattern, bytes):
+            return pattern
+        flags = pattern.flags & ~re.UNICODE
+        pattern = pattern.pattern
+    if isinstance(pattern, str):
+        pattern = pattern.encode()
+    return re.compile(pattern, flags)
+
+
+class TokenBucket:
+    """Ограничитель частоты: в среднем rate событий в секунду, всплеск до burst."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class CircuitOpen(ConnectionError):
+    """Хост недавно раз за разом отклонял подключение — попытка не делается."""
+
+
+class CircuitBreaker:
+    """
+    Размыкатель по (host, username): после threshold отказов подряд
+    подключения отклоняются сразу, без handshake, на cooldown секунд.
+    Затем пропускается одна пробная попытка (half-open): успех замыкает
+    цепь, отказ размыкает её снова.
+    """
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures: Dict[Tuple[str, str], int] = {}
+        self._opened_at: Dict[Tuple[str, str], float] = {}
+        # Ключи, по которым сейчас идёт пробная попытка
+        self._probing: set = set()
+
+    def check(self, key: Tuple[str, str]) -> None:
+        opened_at = self._opened_at.get(key)
+        if opened_at is None:
+            return
+        remaining = opened_at + self.cooldown - time.monotonic()
+        if remaining > 0 or key in self._probing:
+            host, username = key
+            raise CircuitOpen(
+                f"{username}@{host}: {self._failures.get(key, 0)} failed connects in a row, "
+                f"retry in {max(remaining, 0):.0f}s")
+        self._probing.add(key)
+
+    def record_failure(self, key: Tuple[str, str]) -> None:
+        self._probing.discard(key)
+        failures = self._failures.get(key, 0) + 1
+        self._failures[key] = failures
+        if failures >= self.threshold:
+            self._opened_at[key] = time.monotonic()
+
+    def record_success(self, key: Tuple[str, str]) -> None:
+        self._probing.discard(key)
+        self._failures.pop(key, None)
+        self._opened_at.pop(key, None)
+
+    def release(self, key: Tuple[str, str]) -> None:
+        """Попытка кончилась не отказом хоста (отмена, DNS и т.п.) — не в счёт."""
+        self._probing.discard(key)
+
+
+_HANDSHAKE_SEM = asyncio.Semaphore(MAX_CONCURRENT_HANDSHAKES)
+_HANDSHAKE_BUCKET = TokenBucket(HANDSHAKE_RATE, HANDSHAKE_BURST)
+_BREAKER = CircuitBreaker(BREAKER_THRESHOLD, BREAKER_COOLDOWN)
+
+
+@functools.lru_cache(maxsize=64)
+def _fast_regex(compiled: re.Pattern):
+    """
+    Версия паттерна промпта под google-re2, если он установлен. Синтаксис
+    переводится в RE2 (флаги inline, \\Z -> \\z); если RE2 паттерн не
+    понимает — остаётся стандартный re.
+    """
+    if re2 is None:
+        return compiled
+    source = compiled.pattern.replace(rb"\Z", rb"\z")
+    inline = b"".join(
+        flag for mask, flag in ((re.MULTILINE, b"m"), (re.DOTALL, b"s"), (re.IGNORECASE, b"i"))
+        if compiled.flags & mask
+    )
+    if inline:
+        source = b"(?" + inline + b")" + source
+    try:
+        return re2.compile(source)
+    except Exception:
+        return compiled
+
+
+@functools.lru_cache(maxsize=64)
+def _literal_needle(compiled: re.Pattern) -> Optional[bytes]:
+    """Байты паттерна, если в нём нет метасимволов (MCPSSH>, маркеры), иначе None."""
+    if (re.escape(compiled.pattern) == compiled.pattern
+            and not compiled.flags & re.IGNORECASE):
+        return compiled.pattern
+    return None
+
+
+@functools.lru_cache(maxsize=16)
+def _prompt_line_regex(pattern: str) -> re.Pattern:
+    """
+    Regex, вырезающий целые строки с промптом из всего вывода за один
+    sub(). Якоря промпта переводятся в построчные: ведущий ^ — начало
+    строки (с отступом), \\Z — конец строки. Кэш общий для всех сессий.
+    """
+    body = pattern.replace(r"\Z", "$")
+    if body.startswith("^"):
+        lead, body = r"[ \t]*", body[1:]
+    else:
+        lead = r"[^\n]*?"
+    return re.compile(rf"^{lead}(?:{body})[^\n]*\n?", re.MULTILINE)
+
+
+async def open_connection(host, port=22, username="", password=None,
+                          private_key=None, timeout=30,
+                          keepalive_interval=30, keepalive_count_max=3,
+                          compression=False):
+    # SSH-keepalive держат NAT/firewall-состояние для простаивающих в пуле
+    # соединений и позволяют вовремя заметить обрыв
+    kw = dict(host=host, port=port, username=username,
+              known_hosts=None, connect_timeout=timeout,
+              keepalive_interval=keepalive_interval,
+              keepalive_count_max=keepalive_count_max)
+    if private_key:
+        kw["client_keys"] = [asyncssh.import_private_key(private_key)]
+    elif password:
+        kw["password"] = password
+        kw["preferred_auth"] = ["password", "keyboard-interactive"]
+    if compression:
+        kw["compression_algs"] = COMPRESSION_ALGS
+    # Троттлится только настоящий handshake — попадания в POOL сюда не доходят
+    breaker_key = (host, username)
+    _BREAKER.check(breaker_key)
+    try:
+        async with _HANDSHAKE_SEM:
+            await _HANDSHAKE_BUCKET.acquire()
+            conn = await asyncssh.connect(**kw)
+    except (asyncssh.PermissionDenied, asyncssh.ConnectionLost):
+        _BREAKER.record_failure(breaker_key)
+        raise
+    except BaseException:
+        _BREAKER.release(breaker_key)
+        raise
+    _BREAKER.record_success(breaker_key)
+    return conn
+
+
+class BufferOverflow(RuntimeError):
+    """Вывод команды превысил MAX_BUFFER до появления промпта."""
+
+
+def credential_fingerprint(password: Optional[str], private_key: Optional[str]) -> str:
+    """Отпечаток кредов для ключа пула — сами креды в ключе не храним."""
+    if private_key:
+        return asyncssh.import_private_key(private_key).get_fingerprint()
+    if password:
+        return "pw:" + hashlib.sha256(password.encode()).hexdigest()
+    return ""
+
+
+class _PoolEntry:
+    def __init__(self, key: PoolKey, conn: asyncssh.SSHClientConnection):
+        self.key = key
+        self.conn = conn
+        self.refcount = 0
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        # Завершится, когда транспорт закроется (в том числе со стороны сервера)
+        self.closed = asyncio.ensure_future(conn.wait_closed())
+
+    def usable(self, now: float) -> bool:
+        return not self.closed.done() and now - self.created_at < POOL_MAX_AGE
+
+
+class SSHConnectionPool:
+    """
+    Пул аутентифицированных SSH-транспортов.
+
+    Сессии к одному хосту с одними кредами открывают свои shell-каналы
+    поверх общего соединения — без повторного TCP + KEX + auth.
+    """
+
+    def __init__(self):
+        self._entries: Dict[PoolKey, _PoolEntry] = {}
+        self._by_conn: Dict[asyncssh.SSHClientConnection, _PoolEntry] = {}
+        self._locks: Dict[PoolKey, asyncio.Lock] = {}
+        self._reaper_task = None
+
+    async def acquire(
+        self,
+        key: PoolKey,
+        factory: Callable[[], Awaitable[asyncssh.SSHClientConnection]],
+    ) -> asyncssh.SSHClientConnection:
+        """Взять соединение из пула (или открыть через factory) и занять его."""
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            now = time.monotonic()
+            entry = self._entries.get(key)
+            if entry is not None and not entry.usable(now):
+                await self._retire(entry)
+                entry = None
+            if entry is None:
+                entry = _PoolEntry(key, await factory())
+                self._entries[key] = entry
+                self._by_conn[entry.conn] = entry
+            entry.refcount += 1
+            entry.last_used = now
+        if self._reaper_task is None or self._reaper_task.done():
+            self._reaper_task = asyncio.create_task(self._reaper())
+        return entry.conn
+
+    async def release(self, conn: asyncssh.SSHClientConnection) -> None:
+        """Освободить соединение, занятое через acquire."""
+        entry = self._by_conn.get(conn)
+        if entry is None:
+            return
+        entry.refcount -= 1
+        entry.last_used = time.monotonic()
+        # Выведенное из пула соединение закрываем, как только ушёл последний канал
+        if entry.refcount <= 0 and self._entries.get(entry.key) is not entry:
+            await self._close(entry)
+
+    async def discard(self, conn: asyncssh.SSHClientConnection) -> None:
+        """Больше не выдавать соединение: следующий acquire переподключится."""
+        entry = self._by_conn.get(conn)
+        if entry is not None:
+            await self._retire(entry)
+
+    async def _retire(self, entry: _PoolEntry) -> None:
+        if self._entries.get(entry.key) is entry:
+            del self._entries[entry.key]
+        if entry.refcount <= 0:
+            await self._close(entry)
+
+    async def _close(self, entry: _PoolEntry) -> None:
+        self._by_conn.pop(entry.conn, None)
+        if self._entries.get(entry.key) is entry:
+            del self._entries[entry.key]
+        entry.conn.close()
+        try:
+            await entry.closed
+        except Exception:
+            pass
+
+    async def _reaper(self) -> None:
+        """Фоново закрывать простаивающие и устаревшие соединения без каналов."""
+        while self._by_conn:
+            await asyncio.sleep(POOL_REAP_INTERVAL)
+            now = time.monotonic()
+            for entry in list(self._by_conn.values()):
+                if entry.refcount > 0:
+                    continue
+                if now - entry.last_used > POOL_IDLE_TIMEOUT or not entry.usable(now):
+                    await self._close(entry)
+
+    async def close_all(self) -> None:
+        if self._reaper_task is not None:
+            self._reaper_task.cancel()
+            self._reaper_task = None
+        entries = list(self._by_conn.values())
+        self._entries.clear()
+        await asyncio.gather(*(self._close(e) for e in entries),
+                             return_exceptions=True)
+
+
+POOL = SSHConnectionPool()
+
+
+class _ShellChannelSession(asyncssh.SSHClientSession):
+    """
+    Приёмник shell-канала. asyncssh вызывает data_received синхронно в
+    event loop сразу по приходу пакета — без фоновой задачи и таймеров.
+    """
+
+    def __init__(self, owner: "SSHSession"):
+        self._owner = owner
+
+    def data_received(self, data, datatype):
+        self._owner._on_data(data)
+
+    def connection_lost(self, exc):
+        self._owner._on_channel_lost()
 
 
 class SSHSession(ABC):
+    # Скомпилированный (compile_prompt) промпт; подклассы задают его, чтобы
+    # _read_until не компилировал _prompt_pattern на каждом вызове
+    _prompt_regex: Optional[re.Pattern] = None
+    # Если задано — промпт ищется только в последних N байтах буфера
+    _prompt_tail: Optional[int] = None
+    # Байты, без одного из которых промпта в хвосте быть не может (b"#>"):
+    # дешёвый bytes.find до запуска regex
+    _prompt_hint: Optional[bytes] = None
+
     def __init__(self):
         self.host: str = ""
         self.username: str = ""
         self.device_type: str = "generic"
         self.is_connected: bool = False
         self._conn = None
-        self._process = None
-        self._buffer: str = ""
-        self._buffer_lock = asyncio.Lock()
-        self._reader_task = None
+        self._keepalive = (30, 3)  # (interval, count_max) для open_connection
+        self._chan = None
+        # Байты из канала, уже без ANSI; декодируются только когда найден промпт
+        self._buffer = bytearray()
+        # Хвост незавершённой ESC-последовательности из прошлого куска
+        self._ansi_pending = b""
+        # Взводится в _on_data после каждого нового куска данных
+        self._data_event = asyncio.Event()
+        # Приём из канала приостановлен: буфер дорос до MAX_BUFFER
+        self._reading_paused = False
+        # Pipeline: отправленные, но ещё не разобранные команды
+        self._pipeline_queue: asyncio.Queue = asyncio.Queue()
+        self._pipeline_task = None
+        self._pipeline_tag = f"__MCPTAG_{uuid.uuid4().hex}"
+        self._pipeline_seq = 0
 
     async def connect(self, host, port=22, username="", password=None,
-                      private_key=None, timeout=30):
+                      private_key=None, timeout=30,
+                      keepalive_interval=30, keepalive_count_max=3,
+                      compression=False):
+        """
+        Открыть shell-канал. Транспорт берётся из POOL: к уже подключённому
+        хосту с теми же кредами новый handshake не делается. compression
+        включает zlib на транспорте — для сессий с крупным выводом.
+        """
         self.host = host
         self.username = username
-        kw = dict(host=host, port=port, username=username,
-                  known_hosts=None, connect_timeout=timeout)
-        if private_key:
-            kw["client_keys"] = [asyncssh.import_private_key(private_key)]
-        elif password:
-            kw["password"] = password
-            kw["preferred_auth"] = ["password", "keyboard-interactive"]
-        self._conn = await asyncssh.connect(**kw)
-        self._process = await self._conn.create_process(
-            term_type="vt100", term_size=(220, 50))
+        self._keepalive = (keepalive_interval, keepalive_count_max)
+        key = (host, port, username,
+               credential_fingerprint(password, private_key), bool(compression))
+
+        def factory():
+            return open_connection(host, port, username, password,
+                                   private_key, timeout, *self._keepalive,
+                                   compression=compression)
+
+        self._ensure_compiled()
+        self._conn = await POOL.acquire(key, factory)
+        try:
+            self._chan = await self._open_shell()
+        except (asyncssh.Error, OSError):
+            # Соединение из пула оказалось мёртвым — выбросить и переподключиться
+            conn, self._conn = self._conn, None
+            await POOL.discard(conn)
+            await POOL.release(conn)
+            self._conn = await POOL.acquire(key, factory)
+            self._chan = await self._open_shell()
         self.is_connected = True
-        self._reader_task = asyncio.create_task(self._background_reader())
         await self._post_connect()
 
-    async def _background_reader(self):
-        try:
-            while self.is_connected:
-                try:
-                    chunk = await asyncio.wait_for(
-                        self._process.stdout.read(4096), timeout=0.1)
-                    if chunk:
-                        async with self._buffer_lock:
-                            self._buffer += chunk
-                    elif chunk == "":
-                        break
-                except asyncio.TimeoutError:
-                    continue
-                except Exception:
-                    break
-        except Exception:
-            pass
+    def _ensure_compiled(self):
+        """Скомпилировать _prompt_pattern, если подкласс не задал _prompt_regex."""
+        if self._prompt_regex is None:
+            self._prompt_regex = compile_prompt(self._prompt_pattern)
+
+    async def _open_shell(self):
+        chan, _ = await self._conn.create_session(
+            lambda: _ShellChannelSession(self),
+            term_type="vt100", term_size=(220, 50), encoding=None)
+        return chan
+
+    def _on_data(self, chunk: bytes):
+        chunk = self._strip_ansi(chunk)
+        if not chunk:
+            return
+        self._buffer.extend(chunk)
+        self._data_event.set()
+        if len(self._buffer) >= MAX_BUFFER and not self._reading_paused:
+            # Не принимаем из канала, пока буфер не разберут
+            self._reading_paused = True
+            self._chan.pause_reading()
+
+    def _on_channel_lost(self):
+        self.is_connected = False
+        # Будим ожидающих: они дочитают буфер и упрутся в таймаут
+        self._data_event.set()
 
-    async def _read_until(self, pattern, timeout=30.0):
-        compiled = re.compile(pattern, re.MULTILINE | re.DOTALL)
-        deadline = asyncio.get_event_loop().time() + timeout
+    def _strip_ansi(self, chunk: bytes) -> bytes:
+        """
+        Вырезать ANSI из нового куска. Каждый байт чистится один раз при
+        приёме, и _read_until сканирует буфер как есть — без повторного
+        прохода ANSI_BYTES_RE и копии всего буфера на каждом скане.
+        """
+        data = self._ansi_pending + chunk if self._ansi_pending else chunk
+        self._ansi_pending = b""
+        esc = data.rfind(b"\x1b")
+        if esc != -1 and _ANSI_PARTIAL_RE.match(data, esc):
+            data, self._ansi_pending = data[:esc], data[esc:]
+        return ANSI_BYTES_RE.sub(b"", data)
+
+    async def _read_until(self, pattern, timeout=30.0, tail=None):
+        """
+        Ждать pattern в буфере и вернуть вывод до конца совпадения. Всё,
+        что пришло после, остаётся в буфере: в pipeline это уже вывод
+        следующих команд, и терять его нельзя.
+        """
+        compiled = compile_prompt(pattern)
+        # Фиксированный промпт (MCPSSH>) ищем через bytes.find — без regex
+        needle = _literal_needle(compiled)
+        matcher = _fast_regex(compiled) if needle is None else None
+        hint = self._prompt_hint if compiled is self._prompt_regex else None
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        scanned = 0
         while True:
-            async with self._buffer_lock:
-                clean = ANSI_RE.sub("", self._buffer)
-                if compiled.search(clean):
-                    output = self._buffer
-                    self._buffer = ""
-                    return output
-            remaining = deadline - asyncio.get_event_loop().time()
-            if remaining <= 0:
-                async with self._buffer_lock:
-                    buf = self._buffer
+            # Скан синхронный (без await) — data_received не может дописать буфер
+            # между проверкой и clear(), поэтому лок здесь не нужен
+            buf = self._buffer
+            pos = max(0, scanned - PROMPT_WINDOW)
+            if tail:
+                pos = max(pos, len(buf) - tail)
+            scanned = len(buf)
+            end = -1
+            if needle is not None:
+                idx = buf.find(needle, pos)
+                if idx != -1:
+                    end = idx + len(needle)
+            elif not hint or any(buf.find(c, pos) != -1 for c in hint):
+                m = matcher.search(buf, pos)
+                if m is not None:
+                    end = m.end()
+            if end != -1:
+                return self._take(end)
+            if len(buf) >= MAX_BUFFER:
+                # Буфер не чистим: вызывающий может разобрать уже пришедшее
+                # (exec_multi), а следующая команда начнётся с _reset_buffer
+                raise BufferOverflow(
+                    f"Output exceeded {MAX_BUFFER} bytes without '{compiled.pattern.decode()}'; "
+                    f"narrow the command (e.g. '| match ...') or raise SSH_MAX_BUFFER")
+            self._data_event.clear()
+            try:
+                # Таймер на общий дедлайн вместо wait_for: без отдельной
+                # Task и пересчёта остатка на каждом пробуждении
+                async with asyncio.timeout_at(deadline):
+                    await self._data_event.wait()
+            except TimeoutError:
+                buf = self._buffer.decode("utf-8", "replace")
                 raise TimeoutError(
-                    f"Timeout waiting for '{pattern}'.\nBuffer:\n{buf}")
-            await asyncio.sleep(0.05)
+                    f"Timeout waiting for '{compiled.pattern.decode()}'.\nBuffer:\n{buf}") from None
 
     async def _send(self, text):
-        self._process.stdin.write(text)
+        self._chan.write(text.encode())
+
+    def _take(self, end=None) -> str:
+        """
+        Забрать из буфера первые end байт (или всё) и вернуть их текстом.
+        Декодируется прямо из memoryview — без промежуточной копии среза.
+        """
+        if end is None:
+            end = len(self._buffer)
+        with memoryview(self._buffer) as view:
+            output = str(view[:end], "utf-8", "replace")
+        self._drop(end)
+        return output
+
+    def _drop(self, end=None):
+        """Отбросить первые end байт буфера (или все) без декодирования."""
+        buf = self._buffer
+        if end is None:
+            del buf[:]
+        else:
+            del buf[:end]
+        if self._reading_paused and len(buf) < MAX_BUFFER:
+            self._reading_paused = False
+            self._chan.resume_reading()
+
+    def _reset_buffer(self):
+        """
+        Отбросить накопленный вывод. Лок не нужен: буфер трогают только
+        синхронные участки в одном event loop, между ними нет await.
+        """
+        self._drop()
 
     async def send_command(self, command, timeout=30.0):
-        async with self._buffer_lock:
-            self._buffer = ""
+        self._reset_buffer()
         await self._send(command + "\n")
-        output = await self._read_until(self._prompt_pattern, timeout=timeout)
+        output = await self._read_until(
+            self._prompt_regex, timeout=timeout, tail=self._prompt_tail)
         return self._clean_output(output, command)
 
     def _clean_output(self, raw, command):
+        """
+        Убрать эхо команды, строки с промптом и пустые строки. Всё делается
+        несколькими sub() по целому выводу — без split и цикла по строкам
+        на Python, что заметно на многомегабайтных show.
+        """
         cleaned = ANSI_RE.sub("", raw)
-        lines = cleaned.split("\n")
-        result = []
-        skip_echo = True
-        prompt_re = re.compile(self._prompt_pattern)
-        for line in lines:
-            stripped = line.strip()
-            if not stripped:
+        echo = command.strip()
+        if echo:
+            echo_re = rf"^[^\n]*{re.escape(echo)}[^\n]*\n?"
+        else:
+            echo_re = r"^[ \t]*\S[^\n]*\n?"
+        cleaned = re.sub(echo_re, "", cleaned, count=1, flags=re.MULTILINE)
+        cleaned = _prompt_line_regex(self._prompt_pattern).sub("", cleaned)
+        cleaned = _TRAILING_WS_RE.sub("", cleaned)
+        cleaned = _BLANK_LINES_RE.sub("\n", cleaned)
+        return cleaned.strip()
+
+    def _marker_line(self, marker: str) -> str:
+        """
+        Строка-разделитель между командами: в выводе должен появиться ровно
+        сам marker. По умолчанию — комментарий, который CLI печатает эхом.
+        """
+        return f"# {marker}"
+
+    @staticmethod
+    def _split_marked(raw: str, tag: str, end_marker: Optional[str] = None) -> dict:
+        """
+        Разрезать вывод по маркерам '<tag>_<N>__' -> {N: вывод}. Строки с
+        эхом ввода маркеров (есть tag-уникальная часть, но не сам маркер)
+        выбрасываются. Строка с end_marker целиком (вместе с промптом перед
+        ним в эхе) завершает разбор.
+        """
+        marker_re = re.compile(rf"{re.escape(tag)}_(\d+)__")
+        unique = tag.strip("_")
+        outputs: dict = {}
+        current = None
+        for line in raw.split("\n"):
+            if end_marker is not None and end_marker in line:
+                break
+            m = marker_re.search(line)
+            if m:
+                current = int(m.group(1))
+                outputs[current] = []
+            elif unique in line:
                 continue
-            if skip_echo and command.strip() in stripped:
-                skip_echo = False
+            elif current is not None:
+                outputs[current].append(line)
+        return {idx: "\n".join(lines) for idx, lines in outputs.items()}
+
+    async def send_batch(self, commands, timeout=60.0):
+        """
+        Отправить команды одной записью и вернуть вывод каждой (list[str]).
+
+        Перед каждой командой идёт маркер (_marker_line), по маркерам вывод
+        режется на команды; конец пакета — END-маркер, за которым следует промпт.
+        """
+        tag = f"__MCPMARK_{uuid.uuid4().hex}"
+        end_marker = f"{tag}_END__"
+        block = "".join(
+            f"{self._marker_line(f'{tag}_{i}__')}\n{cmd}\n" for i, cmd in enumerate(commands)
+        )
+        block += self._marker_line(end_marker) + "\n"
+
+        self._reset_buffer()
+        await self._send(block)
+        done_re = compile_prompt(
+            re.escape(end_marker).encode() + rb".*" + self._prompt_regex.pattern)
+        raw = await self._read_until(done_re, timeout=timeout)
+
+        outputs = self._split_marked(ANSI_RE.sub("", raw), tag, end_marker)
+        return [self._clean_output(outputs.get(i, ""), cmd) for i, cmd in enumerate(commands)]
+
+    def submit(self, command, timeout=60.0) -> asyncio.Future:
+        """
+        Отправить команду сразу, не дожидаясь ответа на предыдущие.
+        Результат (очищенный вывод) придёт в Future в порядке отправки.
+        """
+        if self._pipeline_task is None or self._pipeline_task.done():
+            # Новый конвейер — старый хвост буфера к нему не относится
+            self._drop()
+            self._pipeline_task = asyncio.create_task(self._pipeline_demux())
+        marker = f"{self._pipeline_tag}_{self._pipeline_seq}__"
+        self._pipeline_seq += 1
+        future = asyncio.get_running_loop().create_future()
+        self._pipeline_queue.put_nowait((command, marker, timeout, future))
+        self._chan.write(f"{command}\n{self._marker_line(marker)}\n".encode())
+        return future
+
+    async def pipeline(self, commands, timeout=60.0):
+        """Выполнить команды конвейером: все уходят сразу, ответы — по маркерам."""
+        futures = [self.submit(cmd, timeout=timeout) for cmd in commands]
+        return list(await asyncio.gather(*futures))
+
+    async def _pipeline_demux(self):
+        """Раздавать вывод по Future: маркеры однозначны, промпт не нужен."""
+        while not self._pipeline_queue.empty():
+            command, marker, timeout, future = self._pipeline_queue.get_nowait()
+            try:
+                raw = await self._read_until(re.escape(marker), timeout=timeout)
+            except asyncio.CancelledError:
+                # close(): ни текущая, ни ждущие в очереди команды ответа не получат
+                self._fail_pipeline(future)
+                raise
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
                 continue
-            if prompt_re.search(stripped):
+            if future.done():
                 continue
-            result.append(line.rstrip())
-        return "\n".join(result).strip()
+            segment = "\n".join(
+                line for line in ANSI_RE.sub("", raw).split("\n")
+                if self._pipeline_tag.strip("_") not in line
+            )
+            future.set_result(self._clean_output(segment, command))
+
+    def _fail_pipeline(self, *futures):
+        """Завершить ошибкой переданные и все оставшиеся в очереди Future."""
+        while not self._pipeline_queue.empty():
+            futures += (self._pipeline_queue.get_nowait()[3],)
+        error = ConnectionError(f"Session to {self.host} closed before the command completed")
+        for future in futures:
+            if not future.done():
+                future.set_exception(error)
+
+    async def stream_command(self, command, timeout=60.0) -> AsyncIterator[str]:
+        """
+        Выполнить команду и отдавать вывод кусками по мере прихода, не держа
+        его целиком в памяти. Последние PROMPT_WINDOW байт придерживаются,
+        пока не ясно, не начало ли это промпта; сам промпт не отдаётся.
+        """
+        self._reset_buffer()
+        await self._send(command + "\n")
+        matcher = _fast_regex(self._prompt_regex)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        echo = command.strip()
+        while True:
+            buf = self._buffer
+            m = matcher.search(buf, max(0, len(buf) - PROMPT_WINDOW))
+            if m is not None:
+                cut = m.start()
+            else:
+                # Отдаём только целые строки до окна, где может начаться промпт
+                cut = buf.rfind(b"\n", 0, max(0, len(buf) - PROMPT_WINDOW)) + 1
+            if cut:
+                text = self._take(cut)
+                if echo:
+                    # Первая строка — эхо самой команды
+                    first, _, rest = text.partition("\n")
+                    if echo in first:
+                        text = rest
+                    echo = ""
+                if text:
+                    yield text
+            if m is not None:
+                self._drop(m.end() - cut)
+                return
+            self._data_event.clear()
+            try:
+                async with asyncio.timeout_at(deadline):
+                    await self._data_event.wait()
+            except TimeoutError:
+                raise TimeoutError(f"Timeout streaming '{command}'") from None
 
     async def send_raw(self, text, wait_seconds=1.0):
-        async with self._buffer_lock:
-            self._buffer = ""
+        self._reset_buffer()
         await self._send(text)
         await asyncio.sleep(wait_seconds)
-        async with self._buffer_lock:
-            output = self._buffer
-            self._buffer = ""
+        output = self._take()
         return ANSI_RE.sub("", output)
 
     @property
@@ -122,20 +740,20 @@ class SSHSession(ABC):
 
     async def close(self):
         self.is_connected = False
-        if self._reader_task:
-            self._reader_task.cancel()
+        if self._pipeline_task:
+            self._pipeline_task.cancel()
             try:
-                await self._reader_task
+                await self._pipeline_task
             except asyncio.CancelledError:
                 pass
-        if self._process:
+        # Команды, отправленные уже после завершения demux-задачи
+        self._fail_pipeline()
+        if self._chan:
             try:
-                self._process.stdin.write_eof()
+                self._chan.write_eof()
+                self._chan.close()
             except Exception:
                 pass
         if self._conn:
-            self._conn.close()
-            try:
-                await self._conn.wait_closed()
-            except Exception:
-                pass
+            conn, self._conn = self._conn, None
+            await POOL.release(conn)